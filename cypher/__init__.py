@@ -1 +1 @@
-__all__ = []
\ No newline at end of file
+__all__: list[str] = []
\ No newline at end of file
@@ -1,10 +1,26 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import struct
+import threading
 import time
 from dataclasses import dataclass, field
-from typing import List, Optional
-from .utils import sha256d_hex, merkle_root_hex, to_json
+from typing import List, Optional, Tuple
+from .utils import sha256d_hex, merkle_root
 from .transaction import Transaction
 
-@dataclass
+# index, timestamp (us), prev_hash, merkle_root; the 4-byte nonce follows
+HEADER_PREFIX_FORMAT = "<IQ32s32s"
+_HEADER_PREFIX = struct.Struct(HEADER_PREFIX_FORMAT)
+NONCES_PER_TIMESTAMP = 100000
+NONCES_PER_TASK = 1 << 15  # one unit of work for a pool worker
+
+_POOL = None
+_POOL_SIZE = 0
+_POOL_LOCK = threading.Lock()
+
+@dataclass(slots=True)
 class Block:
     index: int
     prev_hash: str
@@ -15,18 +31,16 @@ class Block:
     hash: Optional[str] = None
 
     def compute_merkle(self) -> str:
-        txids = [tx.txid for tx in self.txs]
-        return merkle_root_hex(txids)
+        return merkle_root([tx.txid for tx in self.txs]).hex()
+
+    def header_prefix(self) -> bytes:
+        # genesis links to a message rather than a block hash
+        prev = bytes.fromhex(self.prev_hash) if self.index else self.prev_hash.encode()
+        merkle = bytes.fromhex(self.merkle_root) if self.merkle_root else b""
+        return _HEADER_PREFIX.pack(self.index, int(self.timestamp * 1e6), prev, merkle)
 
     def header_preimage(self) -> bytes:
-        header = {
-            "index": self.index,
-            "prev_hash": self.prev_hash,
-            "timestamp": self.timestamp,
-            "nonce": self.nonce,
-            "merkle_root": self.merkle_root or "",
-        }
-        return to_json(header).encode()
+        return self.header_prefix() + self.nonce.to_bytes(4, "little")
 
     def compute_hash(self) -> str:
         return sha256d_hex(self.header_preimage())
@@ -35,16 +49,73 @@ class Block:
         self.merkle_root = self.compute_merkle()
         self.hash = self.compute_hash()
 
-def mine_block(block: Block, difficulty: int) -> Block:
-    prefix = "0" * difficulty
+def difficulty_target(difficulty: int) -> bytes:
+    # largest digest with `difficulty` leading zero hex digits
+    return ((1 << (256 - 4 * difficulty)) - 1).to_bytes(32, "big")
+
+def scan_nonces(prefix: bytes, start: int, stop: int, target: bytes,
+                step: int = 1) -> Optional[Tuple[int, bytes]]:
+    # the first 64-byte block of the header is compressed once; each nonce
+    # only finishes the second block from a copy of that midstate
+    midstate = hashlib.sha256(prefix)
+    sha256 = hashlib.sha256
+    for nonce in range(start, stop, step):
+        h = midstate.copy()
+        h.update(nonce.to_bytes(4, "little"))
+        digest = sha256(h.digest()).digest()
+        if digest <= target:
+            return nonce, digest
+    return None
+
+def _mining_pool(workers: int):
+    # created on first use and kept for every later round and block; started
+    # via forkserver/spawn so workers never fork a multithreaded server
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_SIZE != workers:
+            if _POOL is not None:
+                _POOL.terminate()
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _POOL = multiprocessing.get_context(method).Pool(workers)
+            _POOL_SIZE = workers
+        return _POOL
+
+def _scan_parallel(prefix: bytes, stop: int, target: bytes, workers: int) -> Optional[Tuple[int, bytes]]:
+    # hands out contiguous chunks, at most two per worker in flight; after a
+    # hit nothing new is queued and the chunks still running are drained
+    pool = _mining_pool(workers)
+    results = queue.SimpleQueue()
+    start = pending = 0
+    hit = None
+    while True:
+        while hit is None and start < stop and pending < 2 * workers:
+            end = min(start + NONCES_PER_TASK, stop)
+            pool.apply_async(scan_nonces, (prefix, start, end, target),
+                             callback=results.put, error_callback=results.put)
+            start, pending = end, pending + 1
+        if not pending:
+            return hit
+        result = results.get()
+        pending -= 1
+        if isinstance(result, BaseException):
+            raise result
+        hit = hit or result
+
+def mine_block(block: Block, difficulty: int, workers: int = 0) -> Block:
+    # workers=0 uses every CPU core
+    workers = workers or os.cpu_count() or 1
+    target = difficulty_target(difficulty)
     block.merkle_root = block.compute_merkle()
-    block.nonce = 0
     while True:
-        h = block.compute_hash()
-        if h.startswith(prefix):
-            block.hash = h
+        # only changes when the timestamp is refreshed
+        prefix = block.header_prefix()
+        if workers == 1:
+            found = scan_nonces(prefix, 0, NONCES_PER_TIMESTAMP, target)
+        else:
+            found = _scan_parallel(prefix, NONCES_PER_TIMESTAMP * workers, target, workers)
+        if found:
+            block.nonce, digest = found
+            block.hash = digest.hex()
             return block
-        block.nonce += 1
         # occasional timestamp update to avoid stale headers
-        if block.nonce % 100000 == 0:
-            block.timestamp = time.time()
\ No newline at end of file
+        block.timestamp = time.time()
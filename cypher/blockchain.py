@@ -1,105 +1,154 @@
-import json
 import os
+import struct
 import time
-from typing import Dict, Tuple, List, Optional
+import warnings
+from typing import List, Optional, Set
 from .block import Block, mine_block
-from .transaction import Transaction, TxOutput, make_coinbase
-from .utils import ensure_dir
-from .config import DIFFICULTY, BLOCK_REWARD, PERSIST_DIR, GENESIS_MESSAGE
+from .transaction import MAX_AMOUNT, Transaction, TxInput, TxOutput, make_coinbase
+from .utxo import UTXOSet, UTXOKey, UtxoOverlay
+from .store import ChainStore
+from .utils import ensure_dir, loads
+from .config import DIFFICULTY, BLOCK_REWARD, PERSIST_DIR, GENESIS_MESSAGE, MINING_WORKERS
 
-UTXOKey = Tuple[str, int]
+# raised while packing or hashing header/tx fields that came in malformed
+_MALFORMED = (AttributeError, OverflowError, TypeError, ValueError, struct.error)
 
 class Blockchain:
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
         ensure_dir(self.data_dir)
+        # JSON files written by older nodes, imported once into the store
         self.chain_path = os.path.join(self.data_dir, "chain.json")
-        self.utxo_path = os.path.join(self.data_dir, "utxos.json")
         self.txs_path = os.path.join(self.data_dir, "mempool.json")
+        self.store = ChainStore(os.path.join(self.data_dir, "chain.db"))
         self.chain: List[Block] = []
-        self.utxos: Dict[UTXOKey, TxOutput] = {}
+        self.utxos = UTXOSet()
         self.mempool: List[Transaction] = []
+        # indexes over the mempool: txids and the (txid, vout) outpoints it spends
+        self._mempool_txids: Set[bytes] = set()
+        self._mempool_spent: Set[UTXOKey] = set()
         self._load_or_init()
 
     def _load_or_init(self):
-        if os.path.exists(self.chain_path):
+        if self.store.has_chain():
             self._load()
-        else:
+        elif not (os.path.exists(self.chain_path) and self._import_legacy()):
             self._init_genesis()
 
     def _load(self):
-        with open(self.chain_path, "r") as f:
-            raw = json.load(f)
-        self.chain = []
-        for b in raw["chain"]:
-            txs = []
-            for t in b["txs"]:
-                tx = Transaction(
-                    inputs=[type("TxInput", (), i) for i in t["inputs"]],
-                    outputs=[TxOutput(**o) for o in t["outputs"]],
-                    timestamp=t["timestamp"],
-                    coinbase=t.get("coinbase", False),
-                    txid=t.get("txid")
-                )
-                txs.append(tx)
-            blk = Block(index=b["index"], prev_hash=b["prev_hash"], timestamp=b["timestamp"],
-                        nonce=b["nonce"], txs=txs, merkle_root=b["merkle_root"], hash=b["hash"])
-            self.chain.append(blk)
-        with open(self.utxo_path, "r") as f:
-            raw_utxos = json.load(f)
-        self.utxos = {(k.split(":")[0], int(k.split(":")[1])): TxOutput(**v) for k, v in raw_utxos.items()}
+        self.chain = [self._block_from_raw(b) for b in self.store.blocks()]
+        self.utxos = UTXOSet()
+        for txid, vout, amount, address in self.store.utxos():
+            self.utxos[(txid, vout)] = TxOutput(amount=amount, address=address)
+        self.mempool = [self._tx_from_raw(t) for t in self.store.mempool()]
+        self._reindex_mempool()
+
+    def _import_legacy(self) -> bool:
+        # JSON state from older nodes is replayed through the current
+        # consensus rules rather than trusted. Chains hashed under the old
+        # JSON header/txid rules fail here and are left on disk, unimported.
+        with open(self.chain_path, "rb") as f:
+            chain = [self._block_from_raw(b) for b in loads(f.read())["chain"]]
+        if not chain or not self._valid_genesis(chain[0]):
+            warnings.warn(f"{self.chain_path}: genesis fails the current consensus rules; not imported")
+            return False
+        self.chain = chain[:1]
+        for block in chain[1:]:
+            utxo_view = self._connect_block(block, self.chain[-1]) if block.index == len(self.chain) else None
+            if utxo_view is None:
+                warnings.warn(f"{self.chain_path}: block {block.index} fails the current consensus rules; not imported")
+                self.chain, self.utxos = [], UTXOSet()
+                return False
+            utxo_view.commit_into(self.utxos)
+            self.chain.append(block)
+        with self.store:
+            for b in self.chain:
+                self.store.put_block(b.index, self._block_to_raw(b))
+            for ref, out in self.utxos.items():
+                self.store.put_utxo(ref, out)
+        # pending txs go through admission again; any that fail are dropped
         if os.path.exists(self.txs_path):
-            with open(self.txs_path, "r") as f:
-                raw_mempool = json.load(f)
-            self.mempool = []
-            for t in raw_mempool:
-                tx = Transaction(
-                    inputs=[type("TxInput", (), i) for i in t["inputs"]],
-                    outputs=[TxOutput(**o) for o in t["outputs"]],
-                    timestamp=t["timestamp"],
-                    coinbase=t.get("coinbase", False),
-                    txid=t.get("txid")
-                )
-                self.mempool.append(tx)
-        else:
-            self.mempool = []
-
-    def _persist(self):
-        # chain
-        raw_chain = {
-            "chain": [
-                {
-                    "index": b.index,
-                    "prev_hash": b.prev_hash,
-                    "timestamp": b.timestamp,
-                    "nonce": b.nonce,
-                    "txs": [t.to_dict(include_sig=True) | {"txid": t.txid} for t in b.txs],
-                    "merkle_root": b.merkle_root,
-                    "hash": b.hash
-                } for b in self.chain
-            ]
+            with open(self.txs_path, "rb") as f:
+                for t in loads(f.read()):
+                    self.add_transaction(self._tx_from_raw(t))
+        return True
+
+    @staticmethod
+    def _valid_genesis(block: Block) -> bool:
+        try:
+            return (block.index == 0 and block.prev_hash == GENESIS_MESSAGE
+                    and block.hash.startswith("0" * DIFFICULTY)
+                    and block.compute_hash() == block.hash
+                    and all(tx.coinbase and not tx.outputs and tx.compute_txid() == tx.txid for tx in block.txs)
+                    and block.compute_merkle() == block.merkle_root)
+        except _MALFORMED:
+            return False
+
+    @staticmethod
+    def _tx_from_raw(t: dict) -> Transaction:
+        return Transaction(
+            inputs=[TxInput(**(i | {"txid": bytes.fromhex(i["txid"])})) for i in t["inputs"]],
+            outputs=[TxOutput(**o) for o in t["outputs"]],
+            timestamp=t["timestamp"],
+            coinbase=t.get("coinbase", False),
+            txid=bytes.fromhex(t["txid"]) if t.get("txid") else None
+        )
+
+    @staticmethod
+    def _tx_to_raw(t: Transaction) -> dict:
+        return t.to_dict(include_sig=True) | {"txid": t.txid_hex}
+
+    @classmethod
+    def _block_from_raw(cls, b: dict) -> Block:
+        return Block(index=b["index"], prev_hash=b["prev_hash"], timestamp=b["timestamp"],
+                     nonce=b["nonce"], txs=[cls._tx_from_raw(t) for t in b["txs"]],
+                     merkle_root=b["merkle_root"], hash=b["hash"])
+
+    @classmethod
+    def _block_to_raw(cls, b: Block) -> dict:
+        return {
+            "index": b.index,
+            "prev_hash": b.prev_hash,
+            "timestamp": b.timestamp,
+            "nonce": b.nonce,
+            "txs": [cls._tx_to_raw(t) for t in b.txs],
+            "merkle_root": b.merkle_root,
+            "hash": b.hash
         }
-        with open(self.chain_path, "w") as f:
-            json.dump(raw_chain, f, indent=2)
-        # utxos
-        raw_utxos = {f"{txid}:{vout}": {"amount": out.amount, "address": out.address}
-                     for (txid, vout), out in self.utxos.items()}
-        with open(self.utxo_path, "w") as f:
-            json.dump(raw_utxos, f, indent=2)
-        # mempool
-        with open(self.txs_path, "w") as f:
-            json.dump([t.to_dict(include_sig=True) | {"txid": t.txid} for t in self.mempool], f, indent=2)
 
     def _init_genesis(self):
         # Genesis block with no spendable outputs
         genesis_tx = Transaction(inputs=[], outputs=[], coinbase=True, timestamp=time.time())
         genesis_tx.txid = genesis_tx.compute_txid()
         genesis = Block(index=0, prev_hash=GENESIS_MESSAGE, timestamp=time.time(), txs=[genesis_tx])
-        genesis = mine_block(genesis, DIFFICULTY)
+        genesis = mine_block(genesis, DIFFICULTY, MINING_WORKERS)
         self.chain = [genesis]
-        self.utxos = {}
+        self.utxos = UTXOSet()
         self.mempool = []
-        self._persist()
+        with self.store:
+            self.store.put_block(genesis.index, self._block_to_raw(genesis))
+
+    def _reindex_mempool(self):
+        self._mempool_txids = {t.txid for t in self.mempool}
+        self._mempool_spent = {(i.txid, i.vout) for t in self.mempool for i in t.inputs}
+
+    def _mempool_evictions(self, txs: List[Transaction]) -> List[Transaction]:
+        # pending txs confirmed by a block, plus those that spend an outpoint
+        # the block consumed, found in one pass over the mempool
+        confirmed = {tx.txid for tx in txs}
+        spent = {(i.txid, i.vout) for tx in txs for i in tx.inputs}
+        if self._mempool_txids.isdisjoint(confirmed) and self._mempool_spent.isdisjoint(spent):
+            return []
+        return [t for t in self.mempool
+                if t.txid in confirmed or any((i.txid, i.vout) in spent for i in t.inputs)]
+
+    def _drop_from_mempool(self, removed: List[Transaction]):
+        if not removed:
+            return
+        gone = {id(t) for t in removed}
+        self.mempool = [t for t in self.mempool if id(t) not in gone]
+        self._mempool_txids.difference_update(t.txid for t in removed)
+        self._mempool_spent.difference_update((i.txid, i.vout) for t in removed for i in t.inputs)
 
     def latest_block(self) -> Block:
         return self.chain[-1]
@@ -110,83 +159,95 @@ class Blockchain:
             tx.txid = tx.compute_txid()
         if tx.coinbase:
             return False
-        if not tx.verify(self.utxos):
-            return False
         # prevent double-adding
-        if any(t.txid == tx.txid for t in self.mempool):
+        if tx.txid in self._mempool_txids:
             return False
         # prevent spending already-mempool-spent inputs
-        spent_in_mempool = {(i.txid, i.vout) for t in self.mempool for i in t.inputs}
-        for i in tx.inputs:
-            if (i.txid, i.vout) in spent_in_mempool:
-                return False
-        self.mempool.append(tx)
-        self._persist()
-        return True
-
-    def apply_tx(self, tx: Transaction) -> bool:
-        if tx.coinbase:
-            # Just create outputs
-            for idx, o in enumerate(tx.outputs):
-                self.utxos[(tx.txid, idx)] = o
-            return True
+        spends = [(i.txid, i.vout) for i in tx.inputs]
+        if len(set(spends)) != len(spends):
+            return False
+        if any(ref in self._mempool_spent for ref in spends):
+            return False
         if not tx.verify(self.utxos):
             return False
-        # spend inputs
-        for i in tx.inputs:
-            ref = (i.txid, i.vout)
-            if ref not in self.utxos:
-                return False
-            del self.utxos[ref]
-        # create outputs
-        for idx, o in enumerate(tx.outputs):
-            self.utxos[(tx.txid, idx)] = o
+        self._mempool_txids.add(tx.txid)
+        self._mempool_spent.update(spends)
+        self.mempool.append(tx)
+        with self.store:
+            self.store.put_mempool_tx(tx.txid, self._tx_to_raw(tx))
         return True
 
-    def validate_block(self, block: Block, prev: Block) -> bool:
+    def _connect_block(self, block: Block, prev: Block) -> Optional[UtxoOverlay]:
+        # validates block and returns its UTXO changes, or None if invalid
         # linkage
         if block.prev_hash != prev.hash:
-            return False
-        # PoW
-        if not block.hash or not block.hash.startswith("0" * DIFFICULTY):
-            return False
-        if block.compute_hash() != block.hash:
-            return False
-        # merkle
-        if block.compute_merkle() != block.merkle_root:
-            return False
-        # transactions: first must be coinbase
-        if not block.txs or not block.txs[0].coinbase:
-            return False
+            return None
+        # header and coinbase fields come from peers as-is; packing a
+        # malformed one raises, which just means the block is invalid
+        try:
+            # PoW
+            if not block.hash or not block.hash.startswith("0" * DIFFICULTY):
+                return None
+            if block.compute_hash() != block.hash:
+                return None
+            # merkle
+            if block.compute_merkle() != block.merkle_root:
+                return None
+            # transactions: first must be coinbase
+            if not block.txs or not block.txs[0].coinbase:
+                return None
+            if any(tx.coinbase for tx in block.txs[1:]):
+                return None
+            if any(not isinstance(o.amount, int) or not 0 <= o.amount < MAX_AMOUNT
+                   for tx in block.txs for o in tx.outputs):
+                return None
+            coinbase = block.txs[0]
+            if not isinstance(coinbase.txid, bytes) or len(coinbase.txid) != 32 or coinbase.compute_txid() != coinbase.txid:
+                return None
+        except _MALFORMED:
+            return None
         reward_out = sum(o.amount for o in block.txs[0].outputs)
         if reward_out != BLOCK_REWARD:
-            return False
-        # apply txs on a copy of utxo set
-        utxo_copy = dict(self.utxos)
-        # remove mempool spends to avoid conflicts while verifying block
+            return None
+        # apply txs on an overlay of the utxo set
+        utxo_view = UtxoOverlay(self.utxos)
         for tx in block.txs:
-            if not tx.coinbase and not tx.verify(utxo_copy):
-                return False
+            if not tx.coinbase and not tx.verify(utxo_view):
+                return None
             if tx.coinbase:
                 for idx, o in enumerate(tx.outputs):
-                    utxo_copy[(tx.txid, idx)] = o
+                    utxo_view[(tx.txid, idx)] = o
             else:
                 # spend inputs
                 for i in tx.inputs:
                     ref = (i.txid, i.vout)
-                    if ref not in utxo_copy:
-                        return False
-                    del utxo_copy[ref]
+                    if ref not in utxo_view:
+                        return None
+                    del utxo_view[ref]
                 # create outputs
                 for idx, o in enumerate(tx.outputs):
-                    utxo_copy[(tx.txid, idx)] = o
-        return True
+                    utxo_view[(tx.txid, idx)] = o
+        return utxo_view
 
-    def mine(self, miner_address: str) -> Optional[Block]:
-        # assemble block: coinbase + valid mempool txs
+    def _commit_block(self, block: Block, utxo_view: UtxoOverlay):
+        # persist first; in-memory state only moves once the write committed
+        evicted = self._mempool_evictions(block.txs)
+        with self.store:
+            for ref in utxo_view.removed:
+                self.store.delete_utxo(ref)
+            for ref, out in utxo_view.added.items():
+                self.store.put_utxo(ref, out)
+            self.store.delete_mempool_txs(t.txid for t in evicted)
+            self.store.put_block(block.index, self._block_to_raw(block))
+        utxo_view.commit_into(self.utxos)
+        self._drop_from_mempool(evicted)
+        self.chain.append(block)
+
+    def assemble_block(self, miner_address: str) -> Block:
+        # unmined candidate on the current tip: coinbase + valid mempool txs
         coinbase = make_coinbase(miner_address, BLOCK_REWARD)
         selected: List[Transaction] = [coinbase]
-        utxo_temp = dict(self.utxos)
+        utxo_temp = UtxoOverlay(self.utxos)
         for tx in list(self.mempool):
             if tx.verify(utxo_temp):
                 # apply on temp to avoid double-spend within block
@@ -195,34 +256,19 @@ class Blockchain:
                 for idx, o in enumerate(tx.outputs):
                     utxo_temp[(tx.txid, idx)] = o
                 selected.append(tx)
-        block = Block(index=len(self.chain),
-                      prev_hash=self.latest_block().hash,
-                      timestamp=time.time(),
-                      txs=selected)
-        mined = mine_block(block, DIFFICULTY)
-        if self.validate_block(mined, self.latest_block()):
-            # commit effects
-            for tx in selected:
-                self.apply_tx(tx)
-                # remove from mempool if present
-                self.mempool = [t for t in self.mempool if t.txid != tx.txid]
-            self.chain.append(mined)
-            self._persist()
-            return mined
-        return None
+        return Block(index=len(self.chain),
+                     prev_hash=self.latest_block().hash,
+                     timestamp=time.time(),
+                     txs=selected)
 
     def try_add_block(self, block: Block) -> bool:
         if block.index != len(self.chain):
             return False
-        if not self.validate_block(block, self.latest_block()):
+        utxo_view = self._connect_block(block, self.latest_block())
+        if utxo_view is None:
             return False
-        # apply effects
-        for tx in block.txs:
-            self.apply_tx(tx)
-            self.mempool = [t for t in self.mempool if t.txid != tx.txid]
-        self.chain.append(block)
-        self._persist()
+        self._commit_block(block, utxo_view)
         return True
 
     def balance(self, address: str) -> int:
-        return sum(out.amount for out in self.utxos.values() if out.address == address)
\ No newline at end of file
+        return self.utxos.balance(address)
\ No newline at end of file
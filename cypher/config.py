@@ -2,4 +2,5 @@ DIFFICULTY = 4  # number of leading zeros in hex hash
 BLOCK_REWARD = 50
 GENESIS_MESSAGE = "Cypher: A minimal PoW chain"
 NETWORK_MAGIC = "CYPHERNET_1"
-PERSIST_DIR = ".data"  # per-port subdir
\ No newline at end of file
+PERSIST_DIR = ".data"  # per-port subdir
+MINING_WORKERS = 0  # nonce-scanning processes, 0 = one per CPU core
@@ -1,22 +1,44 @@
 import argparse
-import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 import requests
+from requests.adapters import HTTPAdapter
 
-from .block import Block
+from .block import Block, mine_block
 from .blockchain import Blockchain
-from .transaction import Transaction, TxInput, TxOutput, build_simple_tx
+from .transaction import Transaction, TxInput, TxOutput, build_simple_tx, pubkey_to_address
 from .wallet import new_wallet
-from .config import PERSIST_DIR
+from .config import DIFFICULTY, MINING_WORKERS, PERSIST_DIR
+from .utils import dumps, loads
+
+class OrjsonProvider(JSONProvider):
+    # JSONProvider.response (jsonify) builds responses through dumps()
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 STATE = {
     "bc": None,
-    "peers": set()
+    "peers": set(),
+    # requests are served from several threads; the chain is only touched
+    # while holding this
+    "lock": threading.RLock()
 }
 
+# shared keep-alive connections and workers for peer fan-out
+HTTP = requests.Session()
+HTTP.mount("http://", HTTPAdapter(pool_maxsize=32))
+HTTP.mount("https://", HTTPAdapter(pool_maxsize=32))
+BROADCAST_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="broadcast")
+
 def data_dir_for_port(port: int) -> str:
     root = os.path.join(PERSIST_DIR, str(port))
     os.makedirs(root, exist_ok=True)
@@ -36,12 +58,17 @@ def peers_add():
     return jsonify({"ok": True, "peers": sorted(list(STATE["peers"]))})
 
 def broadcast(path: str, payload: dict):
+    # post to all peers at once, so a fan-out costs one round trip, not one per peer
+    body = dumps(payload)
+    headers = {"Content-Type": "application/json"}
+    futures = {BROADCAST_POOL.submit(HTTP.post, f"{p}{path}", data=body, headers=headers, timeout=3): p
+               for p in list(STATE["peers"])}
     dead = []
-    for p in list(STATE["peers"]):
+    for fut in as_completed(futures):
         try:
-            requests.post(f"{p}{path}", json=payload, timeout=3)
+            fut.result()
         except Exception:
-            dead.append(p)
+            dead.append(futures[fut])
     for d in dead:
         STATE["peers"].discard(d)
 
@@ -59,18 +86,19 @@ def tx_new():
     amount = int(data.get("amount", 0))
     if not all([priv, pub, from_addr, to_addr]) or amount <= 0:
         return jsonify({"error": "private_key, public_key, from, to, amount required"}), 400
-    # Build using available UTXOs
-    utxos = {k:v for k,v in STATE["bc"].utxos.items()}
-    try:
-        tx = build_simple_tx(utxos, priv, pub, to_addr, amount, change_addr=from_addr)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
-    ok = STATE["bc"].add_transaction(tx)
+    with STATE["lock"]:
+        # Build using the sender's UTXOs only
+        try:
+            utxos = STATE["bc"].utxos.outputs_of(pubkey_to_address(pub))
+            tx = build_simple_tx(utxos, priv, pub, to_addr, amount, change_addr=from_addr)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+        ok = STATE["bc"].add_transaction(tx)
     if not ok:
         return jsonify({"error": "tx rejected"}), 400
     # broadcast
     broadcast("/tx/broadcast", tx_to_payload(tx))
-    return jsonify({"ok": True, "txid": tx.txid})
+    return jsonify({"ok": True, "txid": tx.txid_hex})
 
 @app.route("/tx/broadcast", methods=["POST"])
 def tx_broadcast():
@@ -79,13 +107,17 @@ def tx_broadcast():
         tx = payload_to_tx(data)
     except Exception:
         return jsonify({"error": "invalid tx"}), 400
-    if STATE["bc"].add_transaction(tx):
+    with STATE["lock"]:
+        ok = STATE["bc"].add_transaction(tx)
+    if ok:
         return jsonify({"ok": True})
     return jsonify({"ok": False}), 400
 
 @app.route("/tx/pending", methods=["GET"])
 def tx_pending():
-    return jsonify([tx_to_payload(t) for t in STATE["bc"].mempool])
+    with STATE["lock"]:
+        pending = list(STATE["bc"].mempool)
+    return jsonify([tx_to_payload(t) for t in pending])
 
 @app.route("/mine", methods=["POST"])
 def mine():
@@ -93,9 +125,15 @@ def mine():
     addr = data.get("miner_address")
     if not addr:
         return jsonify({"error":"miner_address required"}), 400
-    blk = STATE["bc"].mine(addr)
-    if not blk:
-        return jsonify({"error": "mining failed"}), 500
+    # only assembly and commit need the lock; the PoW runs without it
+    with STATE["lock"]:
+        candidate = STATE["bc"].assemble_block(addr)
+    blk = mine_block(candidate, DIFFICULTY, MINING_WORKERS)
+    with STATE["lock"]:
+        # rejected if the tip moved (or the mempool changed) while we mined
+        ok = STATE["bc"].try_add_block(blk)
+    if not ok:
+        return jsonify({"error": "chain tip changed while mining"}), 409
     broadcast("/block/broadcast", block_to_payload(blk))
     return jsonify(block_to_payload(blk))
 
@@ -106,38 +144,53 @@ def block_broadcast():
         blk = payload_to_block(data)
     except Exception:
         return jsonify({"error":"invalid block"}), 400
-    ok = STATE["bc"].try_add_block(blk)
+    with STATE["lock"]:
+        ok = STATE["bc"].try_add_block(blk)
     return jsonify({"ok": ok})
 
 @app.route("/blocks/latest", methods=["GET"])
 def blocks_latest():
-    return jsonify(block_to_payload(STATE["bc"].latest_block()))
+    with STATE["lock"]:
+        latest = STATE["bc"].latest_block()
+    return jsonify(block_to_payload(latest))
 
 @app.route("/chain", methods=["GET"])
 def chain():
-    return jsonify([block_to_payload(b) for b in STATE["bc"].chain])
+    with STATE["lock"]:
+        blocks = list(STATE["bc"].chain)
+
+    # stream the same JSON array one block at a time instead of building it in memory
+    def generate():
+        yield b"["
+        for i, b in enumerate(blocks):
+            yield (b"," if i else b"") + dumps(block_to_payload(b))
+        yield b"]"
+
+    return Response(generate(), mimetype="application/json")
 
 @app.route("/balance/<address>", methods=["GET"])
 def balance(address: str):
-    return jsonify({"address": address, "balance": STATE["bc"].balance(address)})
+    with STATE["lock"]:
+        bal = STATE["bc"].balance(address)
+    return jsonify({"address": address, "balance": bal})
 
 def tx_to_payload(tx: Transaction) -> dict:
     return {
-        "inputs": [{"txid": i.txid, "vout": i.vout, "signature": i.signature, "pubkey": i.pubkey} for i in tx.inputs],
+        "inputs": [{"txid": i.txid.hex(), "vout": i.vout, "signature": i.signature, "pubkey": i.pubkey} for i in tx.inputs],
         "outputs": [{"amount": o.amount, "address": o.address} for o in tx.outputs],
         "timestamp": tx.timestamp,
         "coinbase": tx.coinbase,
-        "txid": tx.txid
+        "txid": tx.txid_hex
     }
 
 def payload_to_tx(p: dict) -> Transaction:
     tx = Transaction(
-        inputs=[TxInput(**i) for i in p["inputs"]],
+        inputs=[TxInput(**(i | {"txid": bytes.fromhex(i["txid"])})) for i in p["inputs"]],
         outputs=[TxOutput(**o) for o in p["outputs"]],
         timestamp=p["timestamp"],
         coinbase=p.get("coinbase", False),
     )
-    tx.txid = p.get("txid") or tx.compute_txid()
+    tx.txid = bytes.fromhex(p["txid"]) if p.get("txid") else tx.compute_txid()
     return tx
 
 def block_to_payload(b: Block) -> dict:
@@ -157,6 +210,21 @@ def payload_to_block(p: dict) -> Block:
               nonce=p["nonce"], txs=txs, merkle_root=p["merkle_root"], hash=p["hash"])
     return b
 
+def init_node(port: int, peers: List[str]):
+    STATE["bc"] = Blockchain(data_dir_for_port(port))
+    for p in peers:
+        STATE["peers"].add(p.rstrip("/"))
+
+def create_app() -> Flask:
+    # WSGI entry point, e.g.
+    #   gunicorn -w 1 -k gthread --threads 8 "cypher.node:create_app()"
+    # Keep a single worker process: chain state lives in memory and would
+    # diverge across processes. Threads share it under STATE["lock"].
+    if STATE["bc"] is None:
+        port = int(os.environ.get("CYPHER_PORT") or os.environ.get("PORT") or 5001)
+        init_node(port, os.environ.get("CYPHER_PEERS", "").split())
+    return app
+
 def main():
     parser = argparse.ArgumentParser(description="Cypher node")
     parser.add_argument("--port", type=int, default=5001)
@@ -164,13 +232,9 @@ def main():
     parser.add_argument("--peers", type=str, nargs="*", default=[])
     args = parser.parse_args()
 
-    data_dir = data_dir_for_port(args.port)
-    bc = Blockchain(data_dir)
-    STATE["bc"] = bc
-    for p in args.peers:
-        STATE["peers"].add(p.rstrip("/"))
-
-    app.run(host=args.host, port=args.port)
+    init_node(args.port, args.peers)
+    # development server; use create_app() under a WSGI server in production
+    app.run(host=args.host, port=args.port, threaded=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import sqlite3
+from typing import Iterable, Iterator, Tuple
+from .transaction import TxOutput
+from .utxo import UTXOKey
+from .utils import dumps, loads
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS utxos (
+    txid BLOB NOT NULL,
+    vout INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    PRIMARY KEY (txid, vout)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mempool (
+    seq INTEGER PRIMARY KEY,
+    txid BLOB NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+"""
+
+# sqlite-backed node state, written incrementally. Writes join the current
+# transaction; use the store as a context manager to commit them together.
+class ChainStore:
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *exc):
+        return self.db.__exit__(*exc)
+
+    def close(self):
+        self.db.close()
+
+    def has_chain(self) -> bool:
+        return self.db.execute("SELECT 1 FROM blocks LIMIT 1").fetchone() is not None
+
+    def put_block(self, height: int, raw: dict):
+        self.db.execute("INSERT OR REPLACE INTO blocks (height, data) VALUES (?, ?)",
+                        (height, dumps(raw)))
+
+    def blocks(self) -> Iterator[dict]:
+        for (data,) in self.db.execute("SELECT data FROM blocks ORDER BY height"):
+            yield loads(data)
+
+    def put_utxo(self, key: UTXOKey, out: TxOutput):
+        self.db.execute("INSERT OR REPLACE INTO utxos (txid, vout, amount, address) VALUES (?, ?, ?, ?)",
+                        (key[0], key[1], out.amount, out.address))
+
+    def delete_utxo(self, key: UTXOKey):
+        self.db.execute("DELETE FROM utxos WHERE txid = ? AND vout = ?", key)
+
+    def utxos(self) -> Iterator[Tuple[bytes, int, int, str]]:
+        return self.db.execute("SELECT txid, vout, amount, address FROM utxos")
+
+    def put_mempool_tx(self, txid: bytes, raw: dict):
+        self.db.execute("INSERT OR REPLACE INTO mempool (txid, data) VALUES (?, ?)",
+                        (txid, dumps(raw)))
+
+    def delete_mempool_txs(self, txids: Iterable[bytes]):
+        self.db.executemany("DELETE FROM mempool WHERE txid = ?", ((t,) for t in txids))
+
+    def mempool(self) -> Iterator[dict]:
+        for (data,) in self.db.execute("SELECT data FROM mempool ORDER BY seq"):
+            yield loads(data)
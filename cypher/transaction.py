@@ -1,30 +1,46 @@
 import time
 import json
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Tuple
-from ecdsa import SigningKey, VerifyingKey, SECP256k1, BadSignatureError
+from functools import lru_cache
+from typing import List, Mapping, Optional, Tuple
+from coincurve import PrivateKey, PublicKey
+from coincurve.ecdsa import cdata_to_der, deserialize_compact
 import hashlib
-from .utils import sha256d_hex, to_json, ripemd160
+import struct
+from .utils import sha256d, ripemd160
 
+MAX_AMOUNT = 2 ** 63  # exclusive; amounts are stored as signed 64-bit sqlite INTEGERs
+
+# bounded, since pubkeys come from untrusted txs
+@lru_cache(maxsize=65536)
 def pubkey_to_address(pubkey_hex: str) -> str:
     pub_bytes = bytes.fromhex(pubkey_hex)
     h = ripemd160(hashlib.sha256(pub_bytes).digest()).hex()
     return "CYPH" + h
 
-@dataclass
+def _pubkey_hex(sk: PrivateKey) -> str:
+    # raw 64-byte X||Y, without the 0x04 SEC prefix
+    return sk.public_key.format(compressed=False)[1:].hex()
+
+def _verify_sig(pubkey_hex: str, sig_hex: str, msg: bytes) -> bool:
+    pk = PublicKey(b"\x04" + bytes.fromhex(pubkey_hex))
+    der = cdata_to_der(deserialize_compact(bytes.fromhex(sig_hex)))
+    return pk.verify(der, msg, hasher=sha256d)
+
+@dataclass(slots=True)
 class TxInput:
-    txid: str
+    txid: bytes
     vout: int
     signature: Optional[str] = None
     pubkey: Optional[str] = None
 
     def to_dict(self, include_sig=True):
-        d = {"txid": self.txid, "vout": self.vout}
+        d = {"txid": self.txid.hex(), "vout": self.vout}
         if include_sig:
             d.update({"signature": self.signature, "pubkey": self.pubkey})
         return d
 
-@dataclass
+@dataclass(slots=True)
 class TxOutput:
     amount: int
     address: str
@@ -32,13 +48,39 @@ class TxOutput:
     def to_dict(self):
         return {"amount": self.amount, "address": self.address}
 
-@dataclass
+_PREIMAGE_FIELDS = frozenset(("inputs", "outputs", "timestamp", "coinbase"))
+
+# precompiled preimage records: header, input, count, output (+ address bytes)
+_TX_HEAD = struct.Struct("<Q?I")
+_TX_INPUT = struct.Struct("<32sI")
+_TX_COUNT = struct.Struct("<I")
+_TX_OUTPUT = struct.Struct("<QH")
+
+@dataclass(slots=True)
 class Transaction:
     inputs: List[TxInput]
     outputs: List[TxOutput]
     timestamp: float = field(default_factory=lambda: time.time())
-    txid: Optional[str] = None
+    txid: Optional[bytes] = None
     coinbase: bool = False
+    # signatures are not part of the preimage, so signing never invalidates these
+    _preimage_cache: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+    _txid_cache: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        if name in _PREIMAGE_FIELDS:
+            self._invalidate()
+        object.__setattr__(self, name, value)
+
+    def _invalidate(self):
+        # reassigning a preimage field calls this; in-place edits of inputs or
+        # outputs must call it explicitly
+        object.__setattr__(self, "_preimage_cache", None)
+        object.__setattr__(self, "_txid_cache", None)
+
+    @property
+    def txid_hex(self) -> str:
+        return self.txid.hex() if self.txid is not None else ""
 
     def to_dict(self, include_sig=True):
         return {
@@ -48,18 +90,34 @@ class Transaction:
             "coinbase": self.coinbase,
         }
 
-    def compute_txid(self) -> str:
-        # Exclude signatures for ID preimage
-        preimage = to_json(self.to_dict(include_sig=False)).encode()
-        return sha256d_hex(preimage)
+    def preimage(self) -> bytes:
+        if self._preimage_cache is not None:
+            return self._preimage_cache
+        # Exclude signatures; length-prefixed binary records so every node
+        # hashes and signs the exact same bytes
+        parts = [_TX_HEAD.pack(int(self.timestamp * 1e6), self.coinbase, len(self.inputs))]
+        pack_input = _TX_INPUT.pack
+        parts += [pack_input(tin.txid, tin.vout) for tin in self.inputs]
+        parts.append(_TX_COUNT.pack(len(self.outputs)))
+        pack_output = _TX_OUTPUT.pack
+        for o in self.outputs:
+            addr = o.address.encode()
+            parts.append(pack_output(o.amount, len(addr)))
+            parts.append(addr)
+        self._preimage_cache = b"".join(parts)
+        return self._preimage_cache
 
-    def sign_inputs(self, priv_hex: str, utxo_map: Dict[Tuple[str,int], TxOutput]):
+    def compute_txid(self) -> bytes:
+        if self._txid_cache is None:
+            self._txid_cache = sha256d(self.preimage())
+        return self._txid_cache
+
+    def sign_inputs(self, priv_hex: str, utxo_map: Mapping[Tuple[bytes,int], TxOutput]):
         if self.coinbase:
             self.txid = self.compute_txid()
             return
-        sk = SigningKey.from_string(bytes.fromhex(priv_hex), curve=SECP256k1)
-        vk = sk.get_verifying_key()
-        pub_hex = vk.to_string().hex()
+        sk = PrivateKey(bytes.fromhex(priv_hex))
+        pub_hex = _pubkey_hex(sk)
         from_addr = pubkey_to_address(pub_hex)
         # Validate that all inputs belong to from_addr
         for tin in self.inputs:
@@ -69,31 +127,38 @@ class Transaction:
             if utxo_map[ref].address != from_addr:
                 raise ValueError("Attempting to spend UTXO not owned by provided key")
         # Sign preimage
-        preimage = to_json(self.to_dict(include_sig=False)).encode()
-        sig = sk.sign_deterministic(preimage).hex()
+        # compact r||s; RFC 6979 nonces keep signing deterministic
+        sig = sk.sign_recoverable(self.preimage(), hasher=sha256d)[:64].hex()
         for tin in self.inputs:
             tin.signature = sig
             tin.pubkey = pub_hex
         self.txid = self.compute_txid()
 
-    def verify(self, utxo_map: Dict[Tuple[str,int], TxOutput]) -> bool:
+    def verify(self, utxo_map: Mapping[Tuple[bytes,int], TxOutput]) -> bool:
         if self.coinbase:
             # coinbase has no inputs; extra checks done at block validation
             return True
         try:
             # Verify signatures and ownership
-            preimage = to_json(self.to_dict(include_sig=False)).encode()
+            preimage = self.preimage()
             total_in = 0
+            # inputs signed by one key share a signature; check each pair once
+            checked = set()
+            spent = set()
             for tin in self.inputs:
                 ref = (tin.txid, tin.vout)
-                if ref not in utxo_map:
+                # an outpoint listed twice would be counted twice in total_in
+                if ref in spent or ref not in utxo_map:
                     return False
+                spent.add(ref)
                 utxo = utxo_map[ref]
                 total_in += utxo.amount
                 if not tin.signature or not tin.pubkey:
                     return False
-                vk = VerifyingKey.from_string(bytes.fromhex(tin.pubkey), curve=SECP256k1)
-                vk.verify(bytes.fromhex(tin.signature), preimage)
+                if (tin.pubkey, tin.signature) not in checked:
+                    if not _verify_sig(tin.pubkey, tin.signature, preimage):
+                        return False
+                    checked.add((tin.pubkey, tin.signature))
                 if pubkey_to_address(tin.pubkey) != utxo.address:
                     return False
             total_out = sum(o.amount for o in self.outputs)
@@ -101,8 +166,6 @@ class Transaction:
                 return False
             # txid consistent
             return self.compute_txid() == self.txid
-        except BadSignatureError:
-            return False
         except Exception:
             return False
 
@@ -111,7 +174,7 @@ def make_coinbase(to_address: str, amount: int) -> Transaction:
     tx.txid = tx.compute_txid()
     return tx
 
-def build_simple_tx(utxos: Dict[Tuple[str,int], TxOutput], from_priv_hex: str, from_pub_hex: str, to_addr: str, amount: int, change_addr: Optional[str]=None) -> Transaction:
+def build_simple_tx(utxos: Mapping[Tuple[bytes,int], TxOutput], from_priv_hex: str, from_pub_hex: str, to_addr: str, amount: int, change_addr: Optional[str]=None) -> Transaction:
     # Collect inputs until amount is covered
     owner_addr = pubkey_to_address(from_pub_hex)
     available = [(k,v) for k,v in utxos.items() if v.address == owner_addr]
@@ -133,9 +196,8 @@ def build_simple_tx(utxos: Dict[Tuple[str,int], TxOutput], from_priv_hex: str, f
     return tx
 
 def generate_keypair() -> Tuple[str,str,str]:
-    sk = SigningKey.generate(curve=SECP256k1)
-    vk = sk.get_verifying_key()
-    priv_hex = sk.to_string().hex()
-    pub_hex = vk.to_string().hex()
+    sk = PrivateKey()
+    priv_hex = sk.secret.hex()
+    pub_hex = _pubkey_hex(sk)
     addr = pubkey_to_address(pub_hex)
     return priv_hex, pub_hex, addr
\ No newline at end of file
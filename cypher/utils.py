@@ -1,7 +1,10 @@
 import hashlib
-import json
 import os
 from typing import List
+import orjson
+
+def sha256d(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
 
 def sha256d_hex(data: bytes) -> str:
     return hashlib.sha256(hashlib.sha256(data).digest()).hexdigest()
@@ -11,21 +14,30 @@ def ripemd160(data: bytes) -> bytes:
     h.update(data)
     return h.digest()
 
-def to_json(obj) -> str:
-    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+def merkle_root(leaves: List[bytes]) -> bytes:
+    if not leaves:
+        return sha256d(b"")
+    sha256 = hashlib.sha256
+    n = len(leaves)
+    # one buffer for the whole tree; each level's parents are written over
+    # the front of it. The spare slot takes the duplicated last node of an
+    # odd level.
+    buf = bytearray(32 * (n + 1))
+    buf[:32 * n] = b"".join(leaves)
+    view = memoryview(buf)
+    while n > 1:
+        if n % 2:
+            view[32 * n:32 * n + 32] = view[32 * (n - 1):32 * n]
+            n += 1
+        view[:16 * n] = b"".join([sha256(sha256(view[i:i + 64]).digest()).digest()
+                                  for i in range(0, 32 * n, 64)])
+        n //= 2
+    return bytes(view[:32])
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
 
-def merkle_root_hex(txids: List[str]) -> str:
-    if not txids:
-        return sha256d_hex(b"")
-    level = txids[:]
-    while len(level) > 1:
-        nxt = []
-        for i in range(0, len(level), 2):
-            left = level[i]
-            right = level[i+1] if i+1 < len(level) else left
-            nxt.append(sha256d_hex(bytes.fromhex(left) + bytes.fromhex(right)))
-        level = nxt
-    return level[0]
+loads = orjson.loads
 
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
\ No newline at end of file
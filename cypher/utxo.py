@@ -0,0 +1,186 @@
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Set, Tuple
+import numpy as np
+from .transaction import MAX_AMOUNT, TxOutput
+
+UTXOKey = Tuple[bytes, int]
+
+FREE = np.uint32(0xFFFFFFFF)  # addr_id of a spent (reusable) row
+COLUMNS = ("txids", "vouts", "amounts", "addr_ids")
+
+# Columnar UTXO set: one NumPy array per field plus a (txid, vout) -> row
+# index. Behaves like Dict[UTXOKey, TxOutput]; TxOutputs are built on access.
+class UTXOSet(MutableMapping):
+    def __init__(self, capacity: int = 1024):
+        self.txids = np.zeros((capacity, 32), dtype=np.uint8)
+        self.vouts = np.zeros(capacity, dtype=np.uint32)
+        self.amounts = np.zeros(capacity, dtype=np.uint64)
+        self.addr_ids = np.full(capacity, FREE, dtype=np.uint32)
+        self.addr_table: Dict[str, int] = {}
+        self.addresses: List[str] = []
+        self.addr_balance: Dict[str, int] = {}  # only non-zero balances
+        self.addr_rows: List[int] = []  # live rows per addr_id
+        self._dead_addrs = 0  # addr_ids with no live rows, reclaimed by compact()
+        self._index: Dict[UTXOKey, int] = {}
+        self._free: List[int] = []
+        self._rows = 0  # high-water mark of used rows
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __iter__(self) -> Iterator[UTXOKey]:
+        return iter(self._index)
+
+    def __contains__(self, key) -> bool:
+        return key in self._index
+
+    def __getitem__(self, key: UTXOKey) -> TxOutput:
+        row = self._index[key]
+        return TxOutput(amount=int(self.amounts[row]), address=self.addresses[self.addr_ids[row]])
+
+    def __setitem__(self, key: UTXOKey, out: TxOutput):
+        # checked up front so a bad entry can't leave the index half-updated
+        txid, vout = key
+        if not isinstance(txid, bytes) or len(txid) != 32 or not isinstance(vout, int) or not 0 <= vout <= 0xFFFFFFFF:
+            raise ValueError(f"invalid UTXO key {key!r}")
+        if not isinstance(out.amount, int) or not 0 <= out.amount < MAX_AMOUNT:
+            raise ValueError(f"invalid UTXO amount {out.amount!r}")
+        row = self._index.get(key)
+        if row is None:
+            row = self._free.pop() if self._free else self._append_row()
+            self._index[key] = row
+        else:
+            self._release(row)
+        aid = self._addr_id(out.address)
+        if self.addr_rows[aid] == 0:
+            self._dead_addrs -= 1
+        self.addr_rows[aid] += 1
+        self._credit(out.address, out.amount)
+        self.txids[row] = np.frombuffer(txid, dtype=np.uint8)
+        self.vouts[row] = vout
+        self.amounts[row] = out.amount
+        self.addr_ids[row] = aid
+
+    def __delitem__(self, key: UTXOKey):
+        row = self._index.pop(key)
+        self._release(row)
+        self.amounts[row] = 0
+        self.addr_ids[row] = FREE
+        self._free.append(row)
+        if (self._rows > 1024 and len(self._free) * 2 > self._rows) or \
+                (self._dead_addrs > 1024 and self._dead_addrs * 2 > len(self.addresses)):
+            self.compact()
+
+    def _release(self, row: int):
+        # takes the row's output off its address, before the row is reused
+        aid = int(self.addr_ids[row])
+        self._credit(self.addresses[aid], -int(self.amounts[row]))
+        self.addr_rows[aid] -= 1
+        if self.addr_rows[aid] == 0:
+            self._dead_addrs += 1
+
+    def _credit(self, address: str, delta: int):
+        bal = self.addr_balance.get(address, 0) + delta
+        if bal:
+            self.addr_balance[address] = bal
+        else:
+            self.addr_balance.pop(address, None)
+
+    def _addr_id(self, address: str) -> int:
+        aid = self.addr_table.get(address)
+        if aid is None:
+            aid = self.addr_table[address] = len(self.addresses)
+            self.addresses.append(address)
+            self.addr_rows.append(0)
+            self._dead_addrs += 1
+        return aid
+
+    def _append_row(self) -> int:
+        if self._rows == len(self.vouts):
+            self._resize(max(2 * self._rows, 1024))
+        self._rows += 1
+        return self._rows - 1
+
+    def _resize(self, capacity: int):
+        for name in COLUMNS:
+            old = getattr(self, name)
+            new = np.full((capacity,) + old.shape[1:], FREE if name == "addr_ids" else 0, dtype=old.dtype)
+            n = min(len(old), capacity)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+    def compact(self):
+        # drop spent rows, keeping live rows in their original order, and
+        # renumber addresses so only those with live rows are kept
+        live = np.fromiter(sorted(self._index.values()), dtype=np.int64, count=len(self._index))
+        for name in COLUMNS:
+            col = getattr(self, name)
+            col[:len(live)] = col[live]
+        self.amounts[len(live):self._rows] = 0
+        self.addr_ids[len(live):self._rows] = FREE
+        self._rows = len(live)
+        self._free = []
+        used, new_ids, counts = np.unique(self.addr_ids[:self._rows], return_inverse=True, return_counts=True)
+        self.addr_ids[:self._rows] = new_ids
+        self.addresses = [self.addresses[aid] for aid in used.tolist()]
+        self.addr_table = {a: aid for aid, a in enumerate(self.addresses)}
+        self.addr_rows = counts.tolist()
+        self._dead_addrs = 0
+        self._reindex()
+
+    def _reindex(self):
+        txids = self.txids[:self._rows].tobytes()
+        self._index = {(txids[32 * r:32 * r + 32], int(v)): r
+                       for r, v in enumerate(self.vouts[:self._rows].tolist())}
+
+    def balance(self, address: str) -> int:
+        return self.addr_balance.get(address, 0)
+
+    def outputs_of(self, address: str) -> Dict[UTXOKey, TxOutput]:
+        # unspent outputs paying `address`, found with a mask over addr_ids
+        aid = self.addr_table.get(address)
+        if aid is None:
+            return {}
+        rows = np.flatnonzero(self.addr_ids[:self._rows] == aid)
+        txids = self.txids[rows].tobytes()
+        return {(txids[32 * i:32 * i + 32], vout): TxOutput(amount=amount, address=address)
+                for i, (vout, amount) in enumerate(zip(self.vouts[rows].tolist(), self.amounts[rows].tolist()))}
+
+# Copy-on-write view over a UTXO mapping: spends and new outputs are
+# recorded on the side, so validating a block costs O(block), not O(UTXO set).
+class UtxoOverlay:
+    def __init__(self, base):
+        self.base = base
+        self.added: Dict[UTXOKey, TxOutput] = {}
+        self.removed: Set[UTXOKey] = set()
+
+    def __contains__(self, ref) -> bool:
+        if ref in self.added:
+            return True
+        return ref not in self.removed and ref in self.base
+
+    def __getitem__(self, ref: UTXOKey) -> TxOutput:
+        if ref in self.added:
+            return self.added[ref]
+        if ref in self.removed:
+            raise KeyError(ref)
+        return self.base[ref]
+
+    def get(self, ref: UTXOKey, default=None):
+        return self[ref] if ref in self else default
+
+    def __setitem__(self, ref: UTXOKey, out: TxOutput):
+        self.added[ref] = out
+
+    def __delitem__(self, ref: UTXOKey):
+        if ref not in self:
+            raise KeyError(ref)
+        self.added.pop(ref, None)
+        if ref in self.base:
+            self.removed.add(ref)
+
+    def commit_into(self, target):
+        for ref in self.removed:
+            del target[ref]
+        for ref, out in self.added.items():
+            target[ref] = out
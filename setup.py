@@ -0,0 +1,25 @@
+import os
+from setuptools import setup
+
+# Optional native build: with mypy installed, the txid/signature/merkle hot
+# paths are compiled with mypyc. Without it (or with CYPHER_MYPYC=0) this is
+# a plain pure-Python package, and the node still runs straight from source.
+ext_modules = []
+if os.environ.get("CYPHER_MYPYC", "1") != "0":
+    try:
+        from mypyc.build import mypycify
+    except ImportError:
+        pass
+    else:
+        ext_modules = mypycify(["cypher/utils.py", "cypher/transaction.py"], opt_level="3")
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "requirements.txt")) as f:
+    install_requires = f.read().split()
+
+setup(
+    name="cypher",
+    version="0.1.0",
+    packages=["cypher"],
+    install_requires=install_requires,
+    ext_modules=ext_modules,
+)